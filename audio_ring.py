@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Audio Ring Buffer Module
+Preallocated, bounded hand-off of audio blocks from the audio callback
+to a service's worker thread.
+"""
+
+import threading
+import queue
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class AudioRing:
+    """
+    Bounded ring of preallocated audio slots for one producer and one consumer.
+
+    put() copies a block into a free slot, so the producer never allocates.
+    When every slot is queued, the oldest queued block is overwritten so the
+    consumer always sees the freshest audio.
+    """
+
+    def __init__(self, capacity: int, block_size: int, dtype=np.float32):
+        """
+        Initialize the ring buffer.
+
+        Args:
+            capacity: Number of blocks the ring can hold
+            block_size: Samples per slot; longer blocks are split across slots
+            dtype: Sample dtype of the slots
+        """
+        self.capacity = max(1, int(capacity))
+        self.block_size = max(1, int(block_size))
+        self.slots = np.empty((self.capacity, self.block_size), dtype=dtype)
+
+        self._free = deque(range(self.capacity))
+        self._ready = deque()  # (slot index, sample count), oldest first
+        self._held: Optional[int] = None  # Slot currently owned by the consumer
+        self._cond = threading.Condition()
+
+    def put(self, audio_data: np.ndarray):
+        """
+        Copy audio into the ring (producer side).
+
+        Args:
+            audio_data: 1D numpy array of audio samples
+        """
+        total = audio_data.shape[0]
+        for start in range(0, total, self.block_size):
+            chunk = audio_data[start:start + self.block_size]
+            with self._cond:
+                if self._free:
+                    index = self._free.popleft()
+                elif self._ready:
+                    index, _ = self._ready.popleft()  # Drop oldest
+                else:
+                    return  # Only slot is held by the consumer
+                n = chunk.shape[0]
+                self.slots[index, :n] = chunk
+                self._ready.append((index, n))
+                self._cond.notify()
+
+    def pending(self) -> int:
+        """Number of blocks queued for the consumer."""
+        with self._cond:
+            return len(self._ready)
+
+    def get(self, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Take the oldest queued block (consumer side).
+
+        The returned array is a view into the ring and stays valid until the
+        next call to get(), which hands its slot back to the producer.
+
+        Args:
+            timeout: Seconds to wait for audio (None waits forever)
+
+        Returns:
+            View of the queued audio samples
+
+        Raises:
+            queue.Empty: If no audio arrived within the timeout
+        """
+        with self._cond:
+            if self._held is not None:
+                self._free.append(self._held)
+                self._held = None
+            if not self._ready:
+                self._cond.wait(timeout)
+                if not self._ready:
+                    raise queue.Empty
+            index, n = self._ready.popleft()
+            self._held = index
+        return self.slots[index, :n]
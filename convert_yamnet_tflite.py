@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+YAMNet TFLite Conversion Script
+Converts the TF Hub YAMNet model to a quantized TFLite model for the
+YAMNet service (set MODEL_PATH in yamnet_config.csv to the output file).
+"""
+
+import argparse
+import glob
+import os
+import wave
+
+import numpy as np
+import tensorflow as tf
+
+from pcm_kernels import PCM16_INV_SCALE
+from yamnet_service import YAMNET_MODEL_URL, load_yamnet_model
+
+# Samples per representative waveform (0.96 s, one YAMNet frame)
+CALIBRATION_SAMPLES = 15360
+
+
+def _load_calibration_audio(audio_dir: str, limit: int):
+    """
+    Read 16 kHz mono 16-bit WAV files as float32 calibration waveforms.
+
+    Args:
+        audio_dir: Directory of .wav files recorded with the target microphone
+        limit: Maximum number of waveforms to return
+
+    Returns:
+        List of 1D float32 arrays of CALIBRATION_SAMPLES samples
+    """
+    waveforms = []
+    for path in sorted(glob.glob(os.path.join(audio_dir, "*.wav"))):
+        with wave.open(path, "rb") as wav:
+            if (wav.getframerate() != 16000 or wav.getnchannels() != 1
+                    or wav.getsampwidth() != 2):
+                print(f"[YAMNet TFLite] Skipping {path}: not 16 kHz mono 16-bit")
+                continue
+            pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        # One fused pass into float32, without an intermediate cast copy
+        audio = np.multiply(pcm, PCM16_INV_SCALE, dtype=np.float32)
+        for start in range(0, audio.shape[0] - CALIBRATION_SAMPLES + 1, CALIBRATION_SAMPLES):
+            waveforms.append(audio[start:start + CALIBRATION_SAMPLES])
+            if len(waveforms) >= limit:
+                return waveforms
+    return waveforms
+
+
+def convert(output_path: str, audio_dir: str = None, num_samples: int = 100, fp16: bool = False):
+    """
+    Convert YAMNet to TFLite with post-training quantization.
+
+    Args:
+        output_path: Where to write the .tflite model
+        audio_dir: Directory of calibration .wav files; enables full int8
+                   quantization of activations (weights only without it)
+        num_samples: Number of calibration waveforms to use
+        fp16: Quantize weights to float16 instead of int8 (also used
+              automatically if int8 conversion fails)
+    """
+    model = load_yamnet_model(YAMNET_MODEL_URL)
+    # Variable-length waveform input, as the service feeds batches of blocks
+    infer = tf.function(
+        lambda waveform: model(waveform)[0],
+        input_signature=[tf.TensorSpec([None], tf.float32)],
+    )
+    concrete_function = infer.get_concrete_function()
+
+    def make_converter():
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete_function], model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        return converter
+
+    tflite_model = None
+    if not fp16:
+        converter = make_converter()
+        if audio_dir:
+            waveforms = _load_calibration_audio(audio_dir, num_samples)
+            if not waveforms:
+                raise ValueError(f"No usable 16 kHz mono 16-bit .wav files in {audio_dir}")
+            print(f"[YAMNet TFLite] Calibrating with {len(waveforms)} waveforms")
+            # Activations are quantized to int8 where a kernel exists; the
+            # spectrogram frontend (FFT) stays float, and so do the input and
+            # output, so the service feeds the same waveforms as to the hub model
+            converter.representative_dataset = lambda: ([w] for w in waveforms)
+        try:
+            tflite_model = converter.convert()
+        except Exception as e:
+            # Some TensorFlow versions cannot quantize YAMNet's frontend ops
+            # (RANGE, PAD, RFFT); float16 weights still halve the model
+            print(f"[YAMNet TFLite] ⚠️ int8 conversion failed, using float16 weights: {e}")
+
+    if tflite_model is None:
+        # Also the choice for CPUs where int8 kernels turn out slower than float
+        converter = make_converter()
+        converter.target_spec.supported_types = [tf.float16]
+        tflite_model = converter.convert()
+
+    with open(output_path, "wb") as file:
+        file.write(tflite_model)
+    print(f"[YAMNet TFLite] ✅ Wrote {output_path} ({len(tflite_model) / 1e6:.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert YAMNet to a quantized TFLite model"
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join("models", "yamnet_int8.tflite"),
+        help="Output .tflite path"
+    )
+    parser.add_argument(
+        "--audio_dir",
+        help="Directory of 16 kHz mono .wav files used to calibrate int8 activations"
+    )
+    parser.add_argument(
+        "--num_samples",
+        type=int,
+        default=100,
+        help="Number of calibration waveforms"
+    )
+    parser.add_argument(
+        "--fp16",
+        action="store_true",
+        help="Quantize weights to float16 instead of int8"
+    )
+
+    args = parser.parse_args()
+    convert(args.output, args.audio_dir, args.num_samples, args.fp16)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Model Threads Module
+Sizes the CPU thread pools of the model-backed services.
+"""
+
+import os
+
+
+def default_num_threads(configured: int = 0) -> int:
+    """
+    Thread count for a model's CPU thread pool.
+
+    Whisper and YAMNet share the CPU; by default each takes half the cores
+    so their thread pools don't oversubscribe it.
+
+    Args:
+        configured: NUM_THREADS from the service config (0 for the default)
+
+    Returns:
+        configured if set, otherwise half the cores (at least 1)
+    """
+    return configured or max(1, (os.cpu_count() or 2) // 2)
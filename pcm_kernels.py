@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+PCM Conversion Module
+Converts audio blocks between float32 and 16-bit PCM using reusable buffers,
+and measures block levels for silence gating.
+"""
+
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; NumPy ufuncs are used instead
+    njit = None
+
+
+# float32 -> int16 uses 32767 so +1.0 maps to the largest positive sample
+PCM16_SCALE = np.float32(32767.0)
+PCM16_INV_SCALE = np.float32(1.0 / 32768.0)
+
+# Clip bounds as float32 scalars so np.clip stays in float32 without promotion
+PCM16_MIN = np.float32(-32768.0)
+PCM16_MAX = np.float32(32767.0)
+
+
+if njit is not None:
+    @njit(cache=True, boundscheck=False)
+    def _f32_to_s16(src, dst):
+        """Scale, clip, round and cast in a single pass over the block."""
+        for i in range(src.shape[0]):
+            v = np.float32(src[i] * np.float32(32767.0))
+            if v > 32767.0:
+                v = np.float32(32767.0)
+            elif v < -32768.0:
+                v = np.float32(-32768.0)
+            dst[i] = np.int16(np.rint(v))
+
+    # Compile up front so the first audio block doesn't pay for the JIT
+    _f32_to_s16(np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.int16))
+else:
+    _f32_to_s16 = None
+
+
+class PCMConverter:
+    """
+    Float32 <-> int16 PCM conversion into preallocated buffers.
+    Each thread that converts audio should own its own converter; the
+    returned arrays are views that are overwritten by the next call.
+    """
+
+    def __init__(self, size: int = 0):
+        """
+        Initialize the converter.
+
+        Args:
+            size: Initial buffer size in samples (buffers grow on demand)
+        """
+        self._f32 = np.empty(size, dtype=np.float32)
+        self._i16 = np.empty(size, dtype=np.int16)
+
+    def _reserve(self, n: int):
+        """Grow the buffers to hold at least n samples."""
+        if self._f32.shape[0] < n:
+            self._f32 = np.empty(n, dtype=np.float32)
+            self._i16 = np.empty(n, dtype=np.int16)
+
+    def to_pcm16(self, audio_data: np.ndarray) -> np.ndarray:
+        """
+        Convert float32 audio (-1.0 to 1.0) to clipped, rounded int16 PCM.
+
+        Args:
+            audio_data: 1D numpy array of float32 samples
+
+        Returns:
+            View of the internal int16 buffer holding the converted samples
+        """
+        n = audio_data.shape[0]
+        self._reserve(n)
+        pcm = self._i16[:n]
+        if _f32_to_s16 is not None:
+            _f32_to_s16(audio_data, pcm)
+            return pcm
+
+        # Scale, clip and round in place, then cast into the int16 buffer
+        scratch = self._f32[:n]
+        np.multiply(audio_data, PCM16_SCALE, out=scratch)
+        np.clip(scratch, PCM16_MIN, PCM16_MAX, out=scratch)
+        np.rint(scratch, out=scratch)
+        np.copyto(pcm, scratch, casting='unsafe')
+        return pcm
+
+    def to_float(self, pcm_data: np.ndarray) -> np.ndarray:
+        """
+        Convert int16 PCM to float32 audio (-1.0 to 1.0).
+
+        Args:
+            pcm_data: 1D numpy array of int16 samples
+
+        Returns:
+            View of the internal float32 buffer holding the converted samples
+        """
+        n = pcm_data.shape[0]
+        self._reserve(n)
+        audio = self._f32[:n]
+        np.multiply(pcm_data, PCM16_INV_SCALE, out=audio)
+        return audio
+
+
+def block_rms(audio_data: np.ndarray) -> float:
+    """
+    RMS level of a float32 block, used for silence gating.
+
+    np.dot reduces in one BLAS pass without the temporary that
+    np.mean(audio_data ** 2) would allocate.
+
+    Args:
+        audio_data: 1D numpy array of float32 samples
+
+    Returns:
+        RMS level (0.0 for an empty block)
+    """
+    n = audio_data.shape[0]
+    if n == 0:
+        return 0.0
+    return math.sqrt(float(np.dot(audio_data, audio_data)) / n)
@@ -6,42 +6,98 @@ Manages Vosk, Whisper, and YAMNet services.
 """
 
 import os
-import csv
+import logging
 import argparse
 import sounddevice as sd
 import numpy as np
-import time
 import signal
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional, Tuple
 
+from pcm_kernels import PCMConverter
 from udp_handler import UDPHandler
 from vosk_service import VoskService
 from whisper_service import WhisperService
 from yamnet_service import YAMNetService
 
 
+logger = logging.getLogger("stt.orchestrator")
+
+# Parsed configs keyed by (absolute path, mtime_ns, size)
+_CONFIG_CACHE: Dict[Tuple[str, int, int], dict] = {}
+
+_BOOL_VALUES = {"true": True, "false": False}
+
+
+def _coerce_value(value: str):
+    """Convert a raw config value to int or bool when it looks like one."""
+    if value.isdigit():
+        return int(value)
+    return _BOOL_VALUES.get(value.lower(), value)
+
+
+def _to_bool(value: str) -> bool:
+    """Parse a true/false config value."""
+    return _BOOL_VALUES[value.lower()]
+
+
+def _to_latency(value: str):
+    """Parse a sounddevice latency: 'low', 'high' or a number of seconds."""
+    name = value.strip().lower()
+    if name in ("low", "high"):
+        return name
+    return float(name)
+
+
+# Known orchestrator keys and their parsers; other keys use _coerce_value
+_CONFIG_SCHEMA = {
+    "SAMPLE_RATE": int,
+    "BLOCK_SIZE": int,
+    "LATENCY": _to_latency,
+    "VOSK_ENABLED": _to_bool,
+    "WHISPER_ENABLED": _to_bool,
+    "YAMNET_ENABLED": _to_bool,
+}
+
+
 class STTOrchestrator:
     """
     Main orchestrator for the modular audio system.
     Manages lifecycle of all audio processing services.
     """
     
-    def __init__(self, base_dir: str):
+    def __init__(self, base_dir: str, overrides: Optional[dict] = None):
         """
         Initialize the orchestrator.
         
         Args:
             base_dir: Base directory for configuration files and models
+            overrides: Config values (e.g. from CLI flags) that take precedence
+                       over orchestrator_config.csv
         """
         self.base_dir = base_dir
         self.running = False
         
+        # Scan the base directory once; config paths are resolved from it
+        try:
+            self._dir_entries = {entry.name: entry for entry in os.scandir(base_dir)}
+        except OSError as e:
+            logger.warning("[Orchestrator] Could not scan %s: %s", base_dir, e)
+            self._dir_entries = {}
+        
         # Load orchestrator configuration
-        self.config = self._load_config(os.path.join(base_dir, "orchestrator_config.csv"))
+        self.config = self._load_config(self._config_path("orchestrator_config.csv"))
+        self.overrides = overrides or {}
         
         # Audio settings
         self.sample_rate = self.config.get("SAMPLE_RATE", 16000)
-        self.block_size = self.config.get("BLOCK_SIZE", 4000)
+        self.block_size = self.config.get("BLOCK_SIZE", 4096)
+        self.latency = self.overrides.get("LATENCY", self.config.get("LATENCY", "low"))
+        if self.block_size & (self.block_size - 1):
+            logger.warning("[Orchestrator] BLOCK_SIZE %s is not a power of two; "
+                           "PortAudio may add buffering to adapt it", self.block_size)
         
         # Initialize UDP handler
         self.udp_handler = UDPHandler()
@@ -50,74 +106,117 @@ class STTOrchestrator:
         self.services = {}
         self._initialize_services()
         
+        # Audio entry points of running services, rebuilt by _refresh_routes()
+        # whenever a service starts or stops so the callback does no lookups
+        self._pcm_routes: Tuple = ()
+        self._float_routes: Tuple = ()
+        # Services start on concurrent workers; serializes the rebuilds
+        self._routes_lock = threading.Lock()
+        
         # Audio stream
         self.stream = None
         
+        # Converts captured PCM for services that only accept float32
+        self._pcm = PCMConverter(self.block_size)
+        
+        # Set by stop() or a signal handler to release the main loop
+        self._stop_event = threading.Event()
+        
+    def _config_path(self, filename: str) -> str:
+        """Resolve a config file in base_dir using the cached directory scan."""
+        entry = self._dir_entries.get(filename)
+        if entry is not None and entry.is_file():
+            return entry.path
+        return os.path.join(self.base_dir, filename)
+    
     def _load_config(self, config_path: str) -> dict:
-        """Load configuration from CSV file."""
+        """Load configuration from CSV file (cached by path, mtime and size)."""
         config = {}
         try:
-            with open(config_path, mode='r') as file:
-                reader = csv.reader(file)
-                next(reader)  # Skip header
-                for row in reader:
-                    if len(row) >= 2:
-                        key, value = row[0], row[1]
-                        # Convert numeric values
-                        if value.isdigit():
-                            config[key] = int(value)
-                        elif value.lower() in ['true', 'false']:
-                            config[key] = value.lower() == 'true'
-                        else:
-                            config[key] = value
-            print(f"[Orchestrator] Configuration loaded from {config_path}")
+            stat = os.stat(config_path)
+            cache_key = (os.path.abspath(config_path), stat.st_mtime_ns, stat.st_size)
+            cached = _CONFIG_CACHE.get(cache_key)
+            if cached is not None:
+                return dict(cached)
+            
+            # Configs are plain two-column key,value files, so a single read
+            # plus partition() is enough (values may be wrapped in quotes)
+            with open(config_path, mode='r', encoding='utf-8') as file:
+                lines = file.read().splitlines()
+            for line in lines[1:]:  # Skip header
+                key, sep, value = line.partition(',')
+                if not sep:
+                    continue
+                key = key.strip().strip('"')
+                value = value.strip().strip('"')
+                parse = _CONFIG_SCHEMA.get(key, _coerce_value)
+                try:
+                    config[key] = parse(value)
+                except (ValueError, KeyError):
+                    config[key] = _coerce_value(value)
+            _CONFIG_CACHE[cache_key] = dict(config)
+            logger.info("[Orchestrator] Configuration loaded from %s", config_path)
         except Exception as e:
-            print(f"[Orchestrator] Error loading config: {e}")
+            logger.error("[Orchestrator] Error loading config: %s", e)
         return config
     
+    def _is_enabled(self, key: str, default: bool) -> bool:
+        """Resolve a *_ENABLED flag, giving overrides precedence over config."""
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.config.get(key, default)
+    
     def _initialize_services(self):
-        """Initialize all configured services."""
-        print("[Orchestrator] Initializing services...")
+        """
+        Initialize all configured services.
+        
+        Every service exposes a ``running`` flag (False until start()
+        succeeds) plus process_audio() and optionally process_audio_pcm16().
+        """
+        logger.info("[Orchestrator] Initializing services...")
         
         # Vosk service
-        if self.config.get("VOSK_ENABLED", True):
+        if self._is_enabled("VOSK_ENABLED", True):
             try:
-                vosk_config = os.path.join(self.base_dir, "vosk_config.csv")
+                vosk_config = self._config_path("vosk_config.csv")
                 self.services["vosk"] = VoskService(
                     vosk_config,
                     self.udp_handler,
                     self.sample_rate,
-                    self.base_dir
+                    self.base_dir,
+                    block_size=self.block_size
                 )
-                print("[Orchestrator] ✅ Vosk service initialized")
+                logger.info("[Orchestrator] ✅ Vosk service initialized")
             except Exception as e:
-                print(f"[Orchestrator] ⚠️ Failed to initialize Vosk: {e}")
+                logger.warning("[Orchestrator] ⚠️ Failed to initialize Vosk: %s", e)
         
         # Whisper service
-        if self.config.get("WHISPER_ENABLED", False):
+        if self._is_enabled("WHISPER_ENABLED", False):
             try:
-                whisper_config = os.path.join(self.base_dir, "whisper_config.csv")
+                whisper_config = self._config_path("whisper_config.csv")
                 self.services["whisper"] = WhisperService(
                     whisper_config,
                     self.udp_handler,
-                    self.sample_rate
+                    self.sample_rate,
+                    block_size=self.block_size
                 )
-                print("[Orchestrator] ✅ Whisper service initialized")
+                logger.info("[Orchestrator] ✅ Whisper service initialized")
             except Exception as e:
-                print(f"[Orchestrator] ⚠️ Failed to initialize Whisper: {e}")
+                logger.warning("[Orchestrator] ⚠️ Failed to initialize Whisper: %s", e)
         
         # YAMNet service
-        if self.config.get("YAMNET_ENABLED", True):
+        if self._is_enabled("YAMNET_ENABLED", True):
             try:
-                yamnet_config = os.path.join(self.base_dir, "yamnet_config.csv")
+                yamnet_config = self._config_path("yamnet_config.csv")
                 self.services["yamnet"] = YAMNetService(
                     yamnet_config,
                     self.udp_handler,
-                    self.sample_rate
+                    self.sample_rate,
+                    block_size=self.block_size
                 )
-                print("[Orchestrator] ✅ YAMNet service initialized")
+                logger.info("[Orchestrator] ✅ YAMNet service initialized")
             except Exception as e:
-                print(f"[Orchestrator] ⚠️ Failed to initialize YAMNet: {e}")
+                logger.warning("[Orchestrator] ⚠️ Failed to initialize YAMNet: %s", e)
     
     def start_service(self, service_name: str) -> bool:
         """
@@ -130,14 +229,16 @@ class STTOrchestrator:
             True if service started successfully, False otherwise
         """
         if service_name not in self.services:
-            print(f"[Orchestrator] Service '{service_name}' not found")
+            logger.warning("[Orchestrator] Service '%s' not found", service_name)
             return False
         
         try:
             return self.services[service_name].start()
         except Exception as e:
-            print(f"[Orchestrator] Error starting {service_name}: {e}")
+            logger.error("[Orchestrator] Error starting %s: %s", service_name, e)
             return False
+        finally:
+            self._refresh_routes()
     
     def stop_service(self, service_name: str):
         """
@@ -150,23 +251,58 @@ class STTOrchestrator:
             try:
                 self.services[service_name].stop()
             except Exception as e:
-                print(f"[Orchestrator] Error stopping {service_name}: {e}")
+                logger.error("[Orchestrator] Error stopping %s: %s", service_name, e)
+            finally:
+                self._refresh_routes()
+    
+    def _refresh_routes(self):
+        """
+        Rebuild the audio routing tables from the running services.
+        
+        Each table is swapped in as a single tuple assignment, so the audio
+        callback always sees a consistent set of routes. Reading the running
+        flags and assigning the tables happen under one lock, so a rebuild
+        from an older snapshot can never overwrite a newer one.
+        """
+        with self._routes_lock:
+            pcm_routes = []
+            float_routes = []
+            for service in list(self.services.values()):
+                if not service.running:
+                    continue
+                process_pcm = getattr(service, 'process_audio_pcm16', None)
+                if process_pcm is not None:
+                    pcm_routes.append(process_pcm)
+                else:
+                    float_routes.append(service.process_audio)
+            self._pcm_routes = tuple(pcm_routes)
+            self._float_routes = tuple(float_routes)
     
     def _audio_callback(self, indata, frames, time_info, status):
         """
         Audio callback function.
         Routes audio to all active services.
+        
+        Audio is captured as int16 PCM and handed to services as a view of
+        the sounddevice buffer, which is reused after this callback returns:
+        services must treat it as read-only and copy anything they keep.
         """
-        if status:
-            print(f"[Orchestrator] Audio warning: {status}")
+        if status and logger.isEnabledFor(logging.WARNING):
+            logger.warning("[Orchestrator] Audio warning: %s", status)
+        
+        # Raw stream delivers mono int16 PCM; wrap it without copying
+        pcm = np.frombuffer(indata, dtype=np.int16)
         
-        # Get audio data as float32 array
-        audio_float = np.asarray(indata, dtype=np.float32).flatten()
+        # Route audio to all running services; services without a PCM entry
+        # point share a single float32 conversion of the block
+        for process_pcm in self._pcm_routes:
+            process_pcm(pcm)
         
-        # Route audio to all active services
-        for service_name, service in self.services.items():
-            if hasattr(service, 'running') and service.running:
-                service.process_audio(audio_float)
+        float_routes = self._float_routes
+        if float_routes:
+            audio_float = self._pcm.to_float(pcm)
+            for process_audio in float_routes:
+                process_audio(audio_float)
     
     def start(self):
         """Start the orchestrator and all enabled services."""
@@ -174,19 +310,27 @@ class STTOrchestrator:
         print("STT Service Orchestrator - Modular Audio System")
         print("="*60 + "\n")
         
-        # Start all enabled services
-        for service_name in self.services:
-            if not self.start_service(service_name):
-                print(f"[Orchestrator] Warning: {service_name} failed to start")
+        # Start all enabled services; model loads run concurrently so startup
+        # takes as long as the slowest model rather than the sum of all
+        if self.services:
+            with ThreadPoolExecutor(max_workers=len(self.services)) as executor:
+                futures = {
+                    executor.submit(self.start_service, service_name): service_name
+                    for service_name in self.services
+                }
+                for future in as_completed(futures):
+                    if not future.result():
+                        logger.warning("[Orchestrator] Warning: %s failed to start", futures[future])
         
         # Start audio stream
-        print("\n[Orchestrator] Starting audio stream...")
+        logger.info("[Orchestrator] Starting audio stream...")
         try:
-            self.stream = sd.InputStream(
+            self.stream = sd.RawInputStream(
                 samplerate=self.sample_rate,
                 blocksize=self.block_size,
-                dtype='float32',
+                dtype='int16',
                 channels=1,
+                latency=self.latency,
                 callback=self._audio_callback
             )
             self.stream.start()
@@ -197,8 +341,7 @@ class STTOrchestrator:
             print("="*60)
             
             # Print active services
-            active_services = [name for name, svc in self.services.items() 
-                             if hasattr(svc, 'running') and svc.running]
+            active_services = [name for name, svc in self.services.items() if svc.running]
             print(f"\n📡 Active services: {', '.join(active_services)}")
             
             # Print UDP port information
@@ -218,14 +361,13 @@ class STTOrchestrator:
             
             print("\n")
             
-            # Main loop
-            while self.running:
-                time.sleep(0.1)
+            # Main loop: block until stop is requested
+            self._stop_event.wait()
                 
         except KeyboardInterrupt:
-            print("\n[Orchestrator] Received interrupt signal")
+            logger.info("[Orchestrator] Received interrupt signal")
         except Exception as e:
-            print(f"[Orchestrator] Error in audio stream: {e}")
+            logger.error("[Orchestrator] Error in audio stream: %s", e)
         finally:
             self.stop()
     
@@ -234,8 +376,9 @@ class STTOrchestrator:
         if not self.running:
             return
         
-        print("\n[Orchestrator] Stopping all services...")
+        logger.info("[Orchestrator] Stopping all services...")
         self.running = False
+        self._stop_event.set()
         
         # Stop audio stream
         if self.stream:
@@ -252,7 +395,7 @@ class STTOrchestrator:
         # Close UDP handler
         self.udp_handler.close_all()
         
-        print("[Orchestrator] ✅ All services stopped gracefully")
+        logger.info("[Orchestrator] ✅ All services stopped gracefully")
 
 
 def main():
@@ -297,34 +440,42 @@ def main():
         help="Disable YAMNet service (overrides config)"
     )
     
+    parser.add_argument(
+        "--latency",
+        type=_to_latency,
+        help="Input latency: 'low', 'high' or seconds (overrides config)"
+    )
+    
     args = parser.parse_args()
     
-    # Create orchestrator
-    orchestrator = STTOrchestrator(args.base_dir)
+    # Diagnostics go through logging; configure output once here
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     
-    # Apply CLI overrides
+    # Collect CLI overrides
+    overrides = {}
     if args.enable_vosk:
-        orchestrator.config["VOSK_ENABLED"] = True
+        overrides["VOSK_ENABLED"] = True
     if args.disable_vosk:
-        orchestrator.config["VOSK_ENABLED"] = False
+        overrides["VOSK_ENABLED"] = False
     if args.enable_whisper:
-        orchestrator.config["WHISPER_ENABLED"] = True
+        overrides["WHISPER_ENABLED"] = True
     if args.disable_whisper:
-        orchestrator.config["WHISPER_ENABLED"] = False
+        overrides["WHISPER_ENABLED"] = False
     if args.enable_yamnet:
-        orchestrator.config["YAMNET_ENABLED"] = True
+        overrides["YAMNET_ENABLED"] = True
     if args.disable_yamnet:
-        orchestrator.config["YAMNET_ENABLED"] = False
+        overrides["YAMNET_ENABLED"] = False
+    if args.latency is not None:
+        overrides["LATENCY"] = args.latency
     
-    # Reinitialize services with updated config
-    orchestrator.services = {}
-    orchestrator._initialize_services()
+    # Create orchestrator (services are initialized once, with overrides applied)
+    orchestrator = STTOrchestrator(args.base_dir, overrides)
     
     # Setup signal handlers
     def signal_handler(sig, frame):
-        print("\n[Orchestrator] Received signal, shutting down...")
-        orchestrator.stop()
-        sys.exit(0)
+        logger.info("[Orchestrator] Received signal, shutting down...")
+        # Only wake the main thread; it performs the shutdown in start()
+        orchestrator._stop_event.set()
     
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -333,7 +484,7 @@ def main():
     try:
         orchestrator.start()
     except Exception as e:
-        print(f"[Orchestrator] Fatal error: {e}")
+        logger.critical("[Orchestrator] Fatal error: %s", e)
         orchestrator.stop()
         sys.exit(1)
 
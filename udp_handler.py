@@ -5,10 +5,23 @@ Centralizes all UDP send/receive logic for the modular audio system.
 """
 
 import socket
+import selectors
 import json
 import threading
 import queue
-from typing import Dict, Callable, Optional
+from typing import Dict, Callable, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json module is used instead
+    orjson = None
+
+
+# Datagrams read from one socket per selector wakeup before moving on
+RECV_BATCH = 32
+
+# Kernel send/receive buffer size so bursts are queued rather than dropped
+SOCKET_BUFFER_SIZE = 2 << 20
 
 
 class UDPHandler:
@@ -26,9 +39,15 @@ class UDPHandler:
         """
         self.default_ip = default_ip
         self.sockets: Dict[int, socket.socket] = {}
-        self.listeners: Dict[int, threading.Thread] = {}
-        self.running_ports: Dict[int, bool] = {}  # Per-port running flags
-        self.callbacks: Dict[int, Callable] = {}
+        # Send sockets connected to one (ip, port) destination each
+        self.send_sockets: Dict[Tuple[str, int], socket.socket] = {}
+        self.callbacks: Dict[int, Callable] = {}  # Listening ports and their callbacks
+        
+        # One selector thread serves every listening socket
+        self._selector = selectors.DefaultSelector()
+        self._dispatch_thread: Optional[threading.Thread] = None
+        self._dispatch_stop = threading.Event()
+        self._wakeup_send: Optional[socket.socket] = None  # Wakes select() on stop
         
     def send_message(self, message: str, port: int, ip: Optional[str] = None) -> bool:
         """
@@ -39,32 +58,59 @@ class UDPHandler:
             port: Destination UDP port
             ip: Destination IP (uses default if None)
             
+        Returns:
+            True if message sent successfully, False otherwise
+        """
+        if not message:
+            return False
+        return self.send_bytes(message.encode("utf-8"), port, ip)
+    
+    def send_bytes(self, payload: bytes, port: int, ip: Optional[str] = None) -> bool:
+        """
+        Send an already-encoded UDP payload to the specified port.
+        
+        Args:
+            payload: Encoded datagram to send
+            port: Destination UDP port
+            ip: Destination IP (uses default if None)
+            
         Returns:
             True if message sent successfully, False otherwise
         """
         try:
-            if not message:
+            if not payload:
                 return False
                 
-            target_ip = ip or self.default_ip
+            destination = (ip or self.default_ip, port)
             
-            # Create socket for this port if it doesn't exist
-            if port not in self.sockets:
-                self.sockets[port] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # Connect one socket per destination so the kernel resolves the
+            # route once instead of on every sendto()
+            sock = self.send_sockets.get(destination)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+                sock.connect(destination)
+                self.send_sockets[destination] = sock
             
-            self.sockets[port].sendto(message.encode("utf-8"), (target_ip, port))
+            try:
+                sock.send(payload)
+            except ConnectionRefusedError:
+                # A connected socket reports an earlier datagram that found no
+                # listener on the next send, and this payload was not sent;
+                # the error is now cleared, so send it once more
+                sock.send(payload)
             return True
             
         except Exception as e:
             print(f"[UDP Handler] Send error on port {port}: {e}")
             return False
     
-    def send_json(self, data: dict, port: int, ip: Optional[str] = None) -> bool:
+    def send_json(self, data: Union[dict, list], port: int, ip: Optional[str] = None) -> bool:
         """
         Send a JSON-encoded message via UDP.
         
         Args:
-            data: Dictionary to send as JSON
+            data: Dictionary (or list of records, sent as one datagram) to send as JSON
             port: Destination UDP port
             ip: Destination IP (uses default if None)
             
@@ -72,44 +118,46 @@ class UDPHandler:
             True if message sent successfully, False otherwise
         """
         try:
-            message = json.dumps(data)
-            return self.send_message(message, port, ip)
+            # orjson encodes straight to UTF-8 bytes, skipping the str round trip
+            if orjson is not None:
+                payload = orjson.dumps(data)
+            else:
+                payload = json.dumps(data).encode("utf-8")
+            return self.send_bytes(payload, port, ip)
         except Exception as e:
             print(f"[UDP Handler] JSON encoding error: {e}")
             return False
     
-    def start_listener(self, port: int, callback: Callable[[str, tuple], None]) -> bool:
+    def start_listener(self, port: int, callback: Callable[[bytes, tuple], None]) -> bool:
         """
         Start a UDP listener on the specified port.
         
         Args:
             port: Port to listen on
-            callback: Function to call with (message, address) when data received
+            callback: Function to call with (payload, address) when data received;
+                      the payload is raw bytes, decoded by the callback if needed
+                      (orjson.loads/json.loads accept bytes directly)
             
         Returns:
             True if listener started successfully, False otherwise
         """
         try:
-            if port in self.listeners:
+            if port in self.callbacks:
                 print(f"[UDP Handler] Listener already running on port {port}")
                 return False
             
-            # Create and bind socket
+            # Create and bind a non-blocking socket for the selector
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
             sock.bind((self.default_ip, port))
-            sock.settimeout(0.5)  # Allow periodic checking of running flag
+            sock.setblocking(False)
             self.sockets[port] = sock
             self.callbacks[port] = callback
+            self._selector.register(sock, selectors.EVENT_READ, port)
             
-            # Start listener thread with per-port running flag
-            self.running_ports[port] = True
-            listener_thread = threading.Thread(
-                target=self._listen_loop,
-                args=(port,),
-                daemon=False
-            )
-            listener_thread.start()
-            self.listeners[port] = listener_thread
+            # Start the shared dispatcher on the first listener
+            if self._dispatch_thread is None:
+                self._start_dispatcher()
             
             print(f"[UDP Handler] Listener started on port {port}")
             return True
@@ -118,26 +166,71 @@ class UDPHandler:
             print(f"[UDP Handler] Failed to start listener on port {port}: {e}")
             return False
     
-    def _listen_loop(self, port: int):
+    def _start_dispatcher(self):
+        """Start the dispatcher thread with a socket pair that can wake it."""
+        wakeup_recv, self._wakeup_send = socket.socketpair()
+        wakeup_recv.setblocking(False)
+        self._selector.register(wakeup_recv, selectors.EVENT_READ, None)
+        self._dispatch_stop.clear()
+        self._dispatch_thread = threading.Thread(
+            target=self._dispatch_loop,
+            args=(wakeup_recv, self._wakeup_send),
+            daemon=False
+        )
+        self._dispatch_thread.start()
+    
+    def _dispatch_loop(self, wakeup_recv: socket.socket, wakeup_send: socket.socket):
         """
-        Internal loop for receiving UDP messages.
+        Internal loop that waits on all listening sockets and runs their callbacks.
+        
+        Blocks in select() without a timeout; stop_listener() wakes it through
+        the wakeup socket pair, which is closed here on exit.
         
         Args:
-            port: Port to listen on
+            wakeup_recv: Receiving end of the wakeup pair (registered with the selector)
+            wakeup_send: Sending end of the wakeup pair
         """
-        sock = self.sockets[port]
-        callback = self.callbacks[port]
-        
-        while self.running_ports.get(port, False):
+        try:
+            self._dispatch_events()
+        finally:
+            try:
+                self._selector.unregister(wakeup_recv)
+            except (KeyError, ValueError):
+                pass
+            wakeup_recv.close()
+            wakeup_send.close()
+    
+    def _dispatch_events(self):
+        """Run callbacks for readable sockets until the dispatcher is stopped."""
+        while not self._dispatch_stop.is_set():
             try:
-                data, addr = sock.recvfrom(4096)
-                message = data.decode("utf-8")
-                callback(message, addr)
-            except socket.timeout:
-                continue
+                events = self._selector.select()
             except Exception as e:
-                if self.running_ports.get(port, False):
-                    print(f"[UDP Handler] Listener error on port {port}: {e}")
+                print(f"[UDP Handler] Listener select error: {e}")
+                break
+            
+            for key, _ in events:
+                port = key.data
+                if port is None:
+                    continue  # Wakeup; the stop flag is checked by the loop
+                callback = self.callbacks.get(port)
+                if callback is None:
+                    continue  # Listener stopped while the event was pending
+                # Drain queued datagrams so a burst costs one select() call
+                recvfrom = key.fileobj.recvfrom
+                for _ in range(RECV_BATCH):
+                    try:
+                        data, addr = recvfrom(4096)
+                    except BlockingIOError:
+                        break
+                    except Exception as e:
+                        if port in self.callbacks:
+                            print(f"[UDP Handler] Listener error on port {port}: {e}")
+                        break
+                    try:
+                        callback(data, addr)
+                    except Exception as e:
+                        print(f"[UDP Handler] Listener error on port {port}: {e}")
     
     def stop_listener(self, port: int):
         """
@@ -146,28 +239,44 @@ class UDPHandler:
         Args:
             port: Port to stop listening on
         """
-        if port in self.listeners:
-            print(f"[UDP Handler] Stopping listener on port {port}")
-            self.running_ports[port] = False
-            self.listeners[port].join(timeout=2.0)
-            del self.listeners[port]
-            if port in self.callbacks:
-                del self.callbacks[port]
-            if port in self.running_ports:
-                del self.running_ports[port]
+        if port not in self.callbacks:
+            return
+        
+        print(f"[UDP Handler] Stopping listener on port {port}")
+        del self.callbacks[port]
+        sock = self.sockets.pop(port, None)
+        if sock is not None:
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()  # Frees the port so the listener can be restarted
+        
+        # Stop the dispatcher once nothing is listening
+        if not self.callbacks and self._dispatch_thread is not None:
+            self._dispatch_stop.set()
+            try:
+                self._wakeup_send.send(b"\0")
+            except OSError:
+                pass
+            thread = self._dispatch_thread
+            self._dispatch_thread = None
+            if thread is not threading.current_thread():
+                thread.join(timeout=2.0)
     
     def close_all(self):
         """Close all UDP sockets and stop all listeners."""
         # Stop all listeners
-        for port in list(self.listeners.keys()):
+        for port in list(self.callbacks.keys()):
             self.stop_listener(port)
         
         # Close all sockets
-        for sock in self.sockets.values():
+        for sock in list(self.sockets.values()) + list(self.send_sockets.values()):
             try:
                 sock.close()
             except:
                 pass
         
         self.sockets.clear()
+        self.send_sockets.clear()
         print("[UDP Handler] All sockets closed")
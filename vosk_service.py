@@ -5,14 +5,53 @@ Handles Vosk STT detection in its own thread.
 """
 
 import os
+import ast
 import csv
 import json
+import logging
+import re
 import threading
 import queue
+import weakref
 import numpy as np
 from typing import Optional
 from vosk import Model, KaldiRecognizer
 
+from audio_ring import AudioRing
+from pcm_kernels import PCMConverter
+
+logger = logging.getLogger("stt.vosk")
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_string = orjson.dumps
+except ImportError:  # orjson is optional; the stdlib json module is used instead
+    _json_loads = json.loads
+    
+    def _json_string(value: str) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+
+# Loaded models by absolute path, kept only while a service uses them
+_MODEL_CACHE = weakref.WeakValueDictionary()
+
+# Matches the single "partial" field of PartialResult() when it has no escapes
+_PARTIAL_RE = re.compile(r'"partial"\s*:\s*"([^"\\]*)"')
+
+
+def _encode_partial_words(words) -> bytes:
+    """
+    Encode partial words as the port 7203 JSON array.
+    
+    Partial records always have the same shape, so only the words are
+    JSON-escaped and the rest is joined as bytes, without building a dict
+    per word.
+    """
+    return b"[" + b",".join(
+        b'{"word":' + _json_string(word) + b',"confidence":null}' for word in words
+    ) + b"]"
+
 
 class VoskService:
     """
@@ -20,7 +59,8 @@ class VoskService:
     Processes audio in a separate thread and sends results via UDP.
     """
     
-    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000, base_dir: str = "."):
+    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000, base_dir: str = ".",
+                 block_size: int = 4096):
         """
         Initialize the Vosk service.
         
@@ -29,12 +69,13 @@ class VoskService:
             udp_handler: UDPHandler instance for sending messages
             sample_rate: Audio sample rate
             base_dir: Base directory for relative paths
+            block_size: Expected samples per audio block (sizes the ring slots)
         """
         self.sample_rate = sample_rate
         self.udp_handler = udp_handler
         self.base_dir = base_dir
         self.running = False
-        self.audio_queue = queue.Queue(maxsize=100)
+        self.audio_ring = AudioRing(100, block_size, dtype=np.int16)
         
         # Load configuration
         self.config = self._load_config(config_path)
@@ -46,6 +87,8 @@ class VoskService:
         # Thread
         self.thread: Optional[threading.Thread] = None
         
+        self._pcm_in = PCMConverter(block_size)
+        
     def _load_config(self, config_path: str) -> dict:
         """Load configuration from CSV file."""
         config = {}
@@ -56,19 +99,15 @@ class VoskService:
                 for row in reader:
                     if len(row) >= 2:
                         key, value = row[0], row[1]
-                        # Convert numeric values
+                        # Numbers (and None/True/False) are parsed as Python
+                        # literals; anything else is kept as a string
                         try:
-                            if '.' in value:
-                                config[key] = float(value)
-                            elif value.isdigit():
-                                config[key] = int(value)
-                            else:
-                                config[key] = value
-                        except ValueError:
+                            config[key] = ast.literal_eval(value)
+                        except (ValueError, SyntaxError):
                             config[key] = value
-            print(f"[Vosk Service] Configuration loaded from {config_path}")
+            logger.info("[Vosk Service] Configuration loaded from %s", config_path)
         except Exception as e:
-            print(f"[Vosk Service] Error loading config: {e}")
+            logger.error("[Vosk Service] Error loading config: %s", e)
         return config
     
     def _initialize_model(self):
@@ -76,20 +115,40 @@ class VoskService:
         try:
             model_path = self.config.get("MODEL_PATH", "models/vosk-model-small-en-us-0.15")
             full_model_path = os.path.join(self.base_dir, model_path)
+            cache_key = os.path.abspath(full_model_path)
             
-            print(f"[Vosk Service] Loading model from {full_model_path}...")
-            self.model = Model(full_model_path)
+            self.model = _MODEL_CACHE.get(cache_key)
+            if self.model is None:
+                logger.info("[Vosk Service] Loading model from %s...", full_model_path)
+                self.model = Model(full_model_path)
+                _MODEL_CACHE[cache_key] = self.model
+            else:
+                logger.info("[Vosk Service] Reusing loaded model from %s", full_model_path)
+            # A fresh recognizer per start so no utterance state carries over
             self.recognizer = KaldiRecognizer(self.model, self.sample_rate)
             self.recognizer.SetWords(True)
-            print("[Vosk Service] ✅ Model loaded successfully")
+            logger.info("[Vosk Service] ✅ Model loaded successfully")
             return True
         except Exception as e:
-            print(f"[Vosk Service] ❌ Error loading model: {e}")
+            logger.error("[Vosk Service] ❌ Error loading model: %s", e)
             return False
     
+    @staticmethod
+    def _parse_partial(raw: str) -> str:
+        """
+        Extract the partial text from a PartialResult() JSON string.
+        
+        Uses a regex fast path and falls back to json.loads for anything
+        it does not recognize (e.g. escaped characters).
+        """
+        match = _PARTIAL_RE.search(raw)
+        if match:
+            return match.group(1)
+        return _json_loads(raw).get("partial", "")
+    
     def process_audio(self, audio_data: np.ndarray):
         """
-        Add audio data to the processing queue.
+        Copy audio data into the processing ring.
         
         Args:
             audio_data: numpy array of audio samples (float32, -1.0 to 1.0)
@@ -97,15 +156,25 @@ class VoskService:
         if not self.running:
             return
         
-        try:
-            # Non-blocking put - drop audio if queue is full
-            self.audio_queue.put_nowait(audio_data.copy())
-        except queue.Full:
-            pass  # Skip if queue is full (maintain real-time performance)
+        # Convert to PCM and copy into a preallocated slot - oldest audio
+        # is dropped if full
+        self.audio_ring.put(self._pcm_in.to_pcm16(audio_data.reshape(-1)))
+    
+    def process_audio_pcm16(self, pcm_data: np.ndarray):
+        """
+        Copy already-converted PCM audio into the processing ring.
+        
+        Args:
+            pcm_data: numpy array of int16 PCM samples
+        """
+        if not self.running:
+            return
+        
+        self.audio_ring.put(pcm_data)
     
     def _recognition_loop(self):
         """Main recognition loop running in a separate thread."""
-        print("[Vosk Service] Recognition thread started")
+        logger.info("[Vosk Service] Recognition thread started")
         
         # Get UDP ports from config
         port_partial = self.config.get("UDP_PORT_PARTIAL", 7201)
@@ -113,65 +182,88 @@ class VoskService:
         port_word_conf = self.config.get("UDP_PORT_WORD_CONF", 7203)
         max_words = self.config.get("MAX_WORDS", 16)
         
+        # Bind per-chunk methods and helpers once so the loop uses local lookups
+        get_audio = self.audio_ring.get
+        accept_waveform = self.recognizer.AcceptWaveform
+        get_result = self.recognizer.Result
+        get_partial = self.recognizer.PartialResult
+        parse_partial = self._parse_partial
+        loads = _json_loads
+        send_message = self.udp_handler.send_message
+        send_json = self.udp_handler.send_json
+        send_bytes = self.udp_handler.send_bytes
+        
+        # Partial results are cumulative within an utterance; remember what
+        # was already sent so repeated partials are skipped
+        last_partial = ""
+        sent_words = []
+        
         while self.running:
             try:
-                # Get audio from queue with timeout
-                audio_data = self.audio_queue.get(timeout=0.1)
-                
-                # Ensure audio is 1D and in the correct format
-                if len(audio_data.shape) > 1:
-                    audio_data = audio_data.flatten()
+                # Get audio from ring with timeout
+                audio_data = get_audio(timeout=0.1)
                 
-                # Convert float32 to int16 PCM bytes for Vosk
-                audio_bytes = (audio_data * 32767.0).clip(-32768, 32767).astype(np.int16).tobytes()
+                # Ring slots already hold int16 PCM for Vosk
+                audio_bytes = audio_data.tobytes()
                 
                 # Feed to recognizer
-                if self.recognizer.AcceptWaveform(audio_bytes):
+                if accept_waveform(audio_bytes):
                     # Finalized segment
-                    result = json.loads(self.recognizer.Result())
+                    result = loads(get_result())
+                    last_partial = ""
+                    sent_words = []
                     text = result.get("text", "").strip()
                     if text:
-                        self.udp_handler.send_message(text, port_final)
+                        send_message(text, port_final)
                     
-                    # Send word + confidence for each word
-                    for word in result.get("result", []):
-                        word_conf = {
+                    # Send word + confidence for all words in one datagram
+                    word_confs = [
+                        {
                             "word": word.get("word"),
                             "confidence": word.get("conf"),
                             "start": word.get("start"),
                             "end": word.get("end"),
                         }
-                        self.udp_handler.send_json(word_conf, port_word_conf)
+                        for word in result.get("result", [])
+                    ]
+                    if word_confs:
+                        send_json(word_confs, port_word_conf)
                 else:
                     # Partial transcription (in progress)
-                    partial = json.loads(self.recognizer.PartialResult())
-                    ptext = partial.get("partial", "")
-                    if ptext:
+                    ptext = parse_partial(get_partial())
+                    if ptext and ptext != last_partial:
+                        last_partial = ptext
+                        
                         # Split into chunks based on max words
                         words = ptext.split()
                         for i in range(0, len(words), max_words):
                             chunk = " ".join(words[i:i + max_words])
-                            self.udp_handler.send_message(chunk, port_partial)
-                            
-                            # Send each word with confidence None
-                            for word in chunk.split():
-                                word_conf = {
-                                    "word": word,
-                                    "confidence": None,
-                                }
-                                self.udp_handler.send_json(word_conf, port_word_conf)
+                            send_message(chunk, port_partial)
+                        
+                        # Send only words not already sent for this utterance
+                        # (all of them if Vosk revised an earlier word)
+                        n_sent = len(sent_words)
+                        if words[:n_sent] == sent_words:
+                            new_words = words[n_sent:]
+                        else:
+                            new_words = words
+                        sent_words = words
+                        
+                        if new_words:
+                            # Words with confidence None in one datagram
+                            send_bytes(_encode_partial_words(new_words), port_word_conf)
                 
             except queue.Empty:
                 continue
             except Exception as e:
-                print(f"[Vosk Service] Recognition error: {e}")
+                logger.error("[Vosk Service] Recognition error: %s", e)
         
-        print("[Vosk Service] Recognition thread stopped")
+        logger.info("[Vosk Service] Recognition thread stopped")
     
     def start(self) -> bool:
         """Start the Vosk service in a separate thread."""
         if self.running:
-            print("[Vosk Service] Already running")
+            logger.info("[Vosk Service] Already running")
             return False
         
         # Initialize model
@@ -181,15 +273,15 @@ class VoskService:
         self.running = True
         self.thread = threading.Thread(target=self._recognition_loop, daemon=False)
         self.thread.start()
-        print("[Vosk Service] Service started")
+        logger.info("[Vosk Service] Service started")
         return True
     
     def stop(self):
         """Stop the Vosk service."""
-        print("[Vosk Service] Stopping...")
+        logger.info("[Vosk Service] Stopping...")
         self.running = False
         if self.thread:
             self.thread.join(timeout=2.0)
             if self.thread.is_alive():
-                print("[Vosk Service] Warning: Thread did not stop within timeout")
-        print("[Vosk Service] Service stopped")
+                logger.warning("[Vosk Service] Warning: Thread did not stop within timeout")
+        logger.info("[Vosk Service] Service stopped")
@@ -4,22 +4,40 @@ Whisper Service Module
 Handles Whisper STT detection in its own thread.
 """
 
+import ast
 import csv
+import logging
 import threading
+import weakref
 import queue
 import numpy as np
 import time
 from typing import Optional
 
+import torch
 import whisper  # <-- Uncommented
 
+try:
+    from faster_whisper import WhisperModel
+except ImportError:  # faster-whisper is optional; openai-whisper is used instead
+    WhisperModel = None
+
+from audio_ring import AudioRing
+from model_threads import default_num_threads
+from pcm_kernels import PCM16_INV_SCALE, PCMConverter, block_rms
+
+logger = logging.getLogger("stt.whisper")
+
+# Loaded models by (backend, size), kept only while a service uses them
+_MODEL_CACHE = weakref.WeakValueDictionary()
+
 class WhisperService:
     """
     Whisper-based speech-to-text service.
     Processes audio in a separate thread and sends results via UDP.
     """
     
-    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000):
+    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000, block_size: int = 4096):
         """
         Initialize the Whisper service.
         
@@ -27,24 +45,30 @@ class WhisperService:
             config_path: Path to Whisper configuration CSV file
             udp_handler: UDPHandler instance for sending messages
             sample_rate: Audio sample rate
+            block_size: Expected samples per audio block (sizes the ring slots)
         """
         self.sample_rate = sample_rate
         self.udp_handler = udp_handler
         self.running = False
-        self.audio_queue = queue.Queue(maxsize=50)
+        self.audio_ring = AudioRing(50, block_size, dtype=np.int16)
+        
+        self._pcm_in = PCMConverter(block_size)
         
         # Load configuration
         self.config = self._load_config(config_path)
         
-        # Whisper model (lazy loaded)
+        # Whisper model (lazy loaded) and the backend that loaded it
         self.model = None
+        self.backend = "openai"
+        # Run on the GPU (with fp16) when CUDA is available
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
         
         # Thread
         self.thread: Optional[threading.Thread] = None
         
-        # Audio buffer for accumulation
-        self.audio_buffer = []
+        # Preallocated float32 buffer that accumulates audio for transcription
         self.buffer_duration = 3.0  # Process every 3 seconds of audio
+        self.audio_buffer = np.empty(int(self.buffer_duration * self.sample_rate), dtype=np.float32)
         
     def _load_config(self, config_path: str) -> dict:
         """Load configuration from CSV file."""
@@ -56,111 +80,180 @@ class WhisperService:
                 for row in reader:
                     if len(row) >= 2:
                         key, value = row[0], row[1]
-                        # Convert numeric values
+                        # Numbers (and None/True/False) are parsed as Python
+                        # literals; anything else is kept as a string
                         try:
-                            if '.' in value:
-                                config[key] = float(value)
-                            elif value.isdigit():
-                                config[key] = int(value)
-                            else:
-                                config[key] = value
-                        except ValueError:
+                            config[key] = ast.literal_eval(value)
+                        except (ValueError, SyntaxError):
                             config[key] = value
-            print(f"[Whisper Service] Configuration loaded from {config_path}")
+            logger.info("[Whisper Service] Configuration loaded from %s", config_path)
         except Exception as e:
-            print(f"[Whisper Service] Error loading config: {e}")
+            logger.error("[Whisper Service] Error loading config: %s", e)
         return config
     
     def _initialize_model(self):
         """Initialize the Whisper model."""
         try:
             model_size = self.config.get("MODEL_SIZE", "base")
-            print(f"[Whisper Service] Loading {model_size} model...")
-            self.model = whisper.load_model(model_size)
-            print("[Whisper Service] ✅ Model loaded successfully")
+            backend = str(self.config.get("BACKEND", "openai")).lower()
+            if backend == "faster" and WhisperModel is None:
+                logger.warning("[Whisper Service] ⚠️ faster-whisper not installed, using openai-whisper")
+                backend = "openai"
+            self.backend = backend
+            
+            cache_key = (backend, model_size)
+            self.model = _MODEL_CACHE.get(cache_key)
+            if self.model is not None:
+                logger.info("[Whisper Service] Reusing loaded %s model", model_size)
+                return True
+            num_threads = default_num_threads(self.config.get("NUM_THREADS", 0))
+            
+            logger.info("[Whisper Service] Loading %s model (%s, %s)...", model_size, backend, self.device)
+            if backend == "faster":
+                # CTranslate2 with int8 weights runs several times faster on CPU
+                self.model = WhisperModel(
+                    model_size,
+                    device=self.device,
+                    compute_type=self.config.get("COMPUTE_TYPE", "int8"),
+                    cpu_threads=num_threads,
+                    num_workers=1,
+                )
+            else:
+                torch.set_num_threads(num_threads)
+                self.model = whisper.load_model(model_size, device=self.device)
+            _MODEL_CACHE[cache_key] = self.model
+            logger.info("[Whisper Service] ✅ Model loaded successfully")
             return True
         except Exception as e:
-            print(f"[Whisper Service] ❌ Error loading model: {e}")
+            logger.error("[Whisper Service] ❌ Error loading model: %s", e)
             return False
     
+    def _transcribe(self, audio_data: np.ndarray, language: Optional[str]) -> str:
+        """
+        Transcribe a buffer with the loaded backend.
+        
+        Args:
+            audio_data: float32 audio at 16 kHz
+            language: Language code, or None to let Whisper detect it
+            
+        Returns:
+            Transcribed text (empty if nothing was recognized)
+        """
+        if self.backend == "faster":
+            segments, _ = self.model.transcribe(
+                audio_data, language=language, beam_size=1, vad_filter=True
+            )
+            return "".join(segment.text for segment in segments).strip()
+        
+        result = self.model.transcribe(audio_data, language=language, fp16=self.device == "cuda")
+        text = result.get("text", "")
+        return text.strip() if isinstance(text, str) else ""
+    
     def process_audio(self, audio_data: np.ndarray):
         """
-        Add audio data to the processing queue.
+        Copy audio data into the processing ring.
         
         Args:
             audio_data: numpy array of audio samples (float32, -1.0 to 1.0)
         """
         if not self.running:
             return
-        try:
-            self.audio_queue.put_nowait(audio_data.copy())
-        except queue.Full:
-            pass
+        self.audio_ring.put(self._pcm_in.to_pcm16(audio_data.reshape(-1)))
+    
+    def process_audio_pcm16(self, pcm_data: np.ndarray):
+        """
+        Copy int16 PCM audio into the processing ring.
+        
+        Args:
+            pcm_data: numpy array of int16 PCM samples
+        """
+        if not self.running:
+            return
+        self.audio_ring.put(pcm_data)
+    
+    def _transcribe_buffer(self, buffer_array: np.ndarray, language: Optional[str],
+                           noise_threshold: float, port_final: int):
+        """
+        Transcribe one full buffer and send the text, skipping silence.
+        
+        Args:
+            buffer_array: float32 audio buffer (reused after this call returns)
+            language: Language code, or None to let Whisper detect it
+            noise_threshold: Minimum RMS level to transcribe
+            port_final: UDP port for the transcription
+        """
+        energy = block_rms(buffer_array)
+        if energy < noise_threshold:
+            return
+        
+        # Whisper transcription
+        if self.model is None:
+            logger.warning("[Whisper Service] Model not loaded, cannot transcribe.")
+            return
+        text = self._transcribe(buffer_array, language)
+        if text:
+            self.udp_handler.send_message(text, port_final)
+            logger.info("[Whisper Service] Transcribed: %s", text)
+        else:
+            logger.debug("[Whisper Service] No transcribed text received.")
     
     def _recognition_loop(self):
-        print("[Whisper Service] Recognition thread started")
+        logger.info("[Whisper Service] Recognition thread started")
         port_partial = self.config.get("UDP_PORT_PARTIAL", 7211)
         port_final = self.config.get("UDP_PORT_FINAL", 7212)
-        noise_threshold = self.config.get("NOISE_THRESHOLD", 0.01)
+        noise_threshold = self.config.get("NOISE_THRESHOLD", 0.0125)
+        # Set language to None if empty or "None"
         language = self.config.get("LANGUAGE", None)
-        if not language or language.lower() == "none":
+        if not language or str(language).lower() == "none":
             language = None
-        samples_per_buffer = int(self.buffer_duration * self.sample_rate)
+        audio_buffer = self.audio_buffer
+        samples_per_buffer = audio_buffer.shape[0]
+        filled = 0
+        
+        # Bind per-block methods once so the loop uses local lookups
+        get_audio = self.audio_ring.get
+        transcribe_buffer = self._transcribe_buffer
+        multiply = np.multiply
         
         while self.running:
             try:
-                audio_data = self.audio_queue.get(timeout=0.1)
-                if len(audio_data.shape) > 1:
-                    audio_data = audio_data.flatten()
-                self.audio_buffer.extend(audio_data)
-                if len(self.audio_buffer) >= samples_per_buffer:
-                    buffer_array = np.array(self.audio_buffer[:samples_per_buffer], dtype=np.float32)
-                    self.audio_buffer = self.audio_buffer[samples_per_buffer:]
-                    energy = np.abs(buffer_array).mean()
-                    if energy < noise_threshold:
-                        continue
-
-                    # Set language to None if empty or "None"
-                    language = self.config.get("LANGUAGE", None)
-                    if not language or str(language).lower() == "none":
-                        language = None
-
-                    # Whisper transcription
-                    if self.model is None:
-                        print("[Whisper Service] Model not loaded, cannot transcribe.")
-                        continue
-                    result = self.model.transcribe(buffer_array, language=language, fp16=False)
-                    text = result.get("text", "")
-                    if isinstance(text, str):
-                        text = text.strip()
-                    if text:
-                        self.udp_handler.send_message(text, port_final)
-                        print(f"[Whisper Service] Transcribed: {text}")
-                    else:
-                        print("[Whisper Service] No transcribed text received.")
+                pcm_data = get_audio(timeout=0.1)
+                
+                # Convert the ring's int16 PCM straight into the accumulation
+                # buffer; a block may complete one buffer and start the next
+                start = 0
+                while start < pcm_data.shape[0]:
+                    take = min(pcm_data.shape[0] - start, samples_per_buffer - filled)
+                    multiply(pcm_data[start:start + take], PCM16_INV_SCALE,
+                             out=audio_buffer[filled:filled + take])
+                    filled += take
+                    start += take
+                    if filled == samples_per_buffer:
+                        filled = 0
+                        transcribe_buffer(audio_buffer, language, noise_threshold, port_final)
             except queue.Empty:
                 continue
             except Exception as e:
-                print(f"[Whisper Service] Recognition error: {e}")
-        print("[Whisper Service] Recognition thread stopped")
+                logger.error("[Whisper Service] Recognition error: %s", e)
+        logger.info("[Whisper Service] Recognition thread stopped")
     
     def start(self) -> bool:
         if self.running:
-            print("[Whisper Service] Already running")
+            logger.info("[Whisper Service] Already running")
             return False
         if not self._initialize_model():
             return False
         self.running = True
         self.thread = threading.Thread(target=self._recognition_loop, daemon=False)
         self.thread.start()
-        print("[Whisper Service] Service started")
+        logger.info("[Whisper Service] Service started")
         return True
     
     def stop(self):
-        print("[Whisper Service] Stopping...")
+        logger.info("[Whisper Service] Stopping...")
         self.running = False
         if self.thread:
             self.thread.join(timeout=2.0)
             if self.thread.is_alive():
-                print("[Whisper Service] Warning: Thread did not stop within timeout")
-        print("[Whisper Service] Service stopped")
+                logger.warning("[Whisper Service] Warning: Thread did not stop within timeout")
+        logger.info("[Whisper Service] Service stopped")
@@ -7,91 +7,107 @@ Runs in a separate thread for independent operation.
 
 import numpy as np
 import tensorflow as tf
-import tensorflow_hub as hub
-import requests
-import socket
 import json
 import threading
 import queue
 import time
 
+from audio_ring import AudioRing
+from pcm_kernels import block_rms
+from udp_handler import UDPHandler
+from yamnet_service import (
+    YAMNET_MODEL_URL, check_sample_rate, drain_backlog,
+    load_class_names, load_yamnet_model, top_class, trace_yamnet_model,
+)
+
+# Shared by every detector: one connected socket per destination, kept open
+# across start()/stop() cycles
+_udp_sender = UDPHandler()
+
 class YAMNetDetector:
     """
     YAMNet-based sound detection service.
     Processes audio in a separate thread and sends detected events via UDP.
     """
     
-    def __init__(self, sample_rate=16000, confidence_threshold=0.3, queue_size=100):
+    def __init__(self, sample_rate=16000, confidence_threshold=0.3, queue_size=100, *, block_size,
+                 max_batch=4, model_path=YAMNET_MODEL_URL, silence_threshold=0.001):
         """
         Initialize the YAMNet detector.
         
         Args:
             sample_rate: Audio sample rate (YAMNet expects 16kHz)
             confidence_threshold: Minimum confidence for detection reporting
-            queue_size: Maximum size of audio processing queue (default 100)
+            queue_size: Number of audio blocks buffered for processing (default 100)
                        Larger values use more memory but handle bursty audio better.
-                       When full, new audio is dropped to maintain real-time performance.
+                       When full, the oldest audio is dropped to maintain real-time performance.
+            block_size: Samples per audio block passed to process_audio(); required,
+                        since XLA compiles the model for multiples of this length
+            max_batch: Maximum number of queued blocks merged into one inference
+                       when the detector falls behind
+            model_path: Local YAMNet SavedModel directory, the TF Hub URL
+                        (downloaded once into models/tfhub), or a .tflite file
+            silence_threshold: Blocks with an RMS level below this skip inference
+                        
+        Raises:
+            ValueError: If sample_rate is not 16 kHz
         """
+        check_sample_rate(sample_rate)
         self.sample_rate = sample_rate
         self.confidence_threshold = confidence_threshold
+        self.silence_threshold = silence_threshold
         self.running = False
-        self.audio_queue = queue.Queue(maxsize=queue_size)
+        # Preallocated slots: process_audio() copies into them, no per-block allocation
+        self.audio_ring = AudioRing(queue_size, block_size)
+        # Backlogged blocks are concatenated here and run through the model once
+        self.batch_buffer = np.empty(max(1, max_batch) * block_size, dtype=np.float32)
         
         # UDP Settings for sound detection output
         self.udp_ip = "127.0.0.1"
         self.udp_port = 7204  # Separate port for sound detection
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         
         # Load YAMNet model
-        print("[YAMNet] Loading model from TensorFlow Hub...")
+        print(f"[YAMNet] Loading model from {model_path}...")
         try:
-            self.model = hub.KerasLayer(
-                "https://tfhub.dev/google/yamnet/1",
-                trainable=False,
-            )
+            self.model = load_yamnet_model(model_path)
             # Load class names
-            self.class_names = self._load_class_names()
+            self.class_names = load_class_names(self.model)
+            # Trace YAMNet as an XLA-compiled graph so the mel frontend and
+            # conv stack run as fused kernels instead of op by op; each
+            # batch length (1..max_batch blocks) is compiled up front
+            self.model = trace_yamnet_model(self.model, block_size, jit_compile=True,
+                                            max_batch=max_batch)
+            # Fixed part of each class's detection message, encoded once
+            self.event_prefixes = [
+                self._event_prefix(class_name, class_id)
+                for class_id, class_name in enumerate(self.class_names)
+            ]
             print("[YAMNet] ✅ Model loaded successfully")
         except Exception as e:
             print(f"[YAMNet] ❌ Error loading model: {e}")
             raise
     
-    def _load_class_names(self):
+    @staticmethod
+    def _event_prefix(class_name, class_id):
         """
-        Load YAMNet class names from the AudioSet CSV.
+        Encode the fixed fields of a detection message.
         
-        Downloads the official class map CSV from the TensorFlow models repository.
-        Falls back to generic class names if download fails.
+        Returns:
+            UTF-8 JSON for {"event": ..., "class_id": ..., with the closing
+            brace left open for the per-detection fields
         """
-        CLASS_MAP_URL = (
-            "https://raw.githubusercontent.com/tensorflow/models/master/"
-            "research/audioset/yamnet/yamnet_class_map.csv"
-        )
-        try:
-            print("[YAMNet] Downloading class map CSV...")
-            response = requests.get(CLASS_MAP_URL, timeout=5)
-            response.raise_for_status()
-            class_names = [
-                line.split(",")[2].strip('"')
-                for line in response.text.splitlines()[1:]
-            ]
-            print(f"[YAMNet] ✅ Loaded {len(class_names)} class names")
-            return class_names
-        except Exception as e:
-            print(f"[YAMNet] ⚠️ Failed to load class map, using generic labels: {e}")
-            return [f"class_{i}" for i in range(521)]
+        return json.dumps({"event": class_name, "class_id": class_id})[:-1].encode("utf-8") + b", "
     
     def send_udp(self, message):
-        """Send detection results via UDP."""
-        try:
-            if message:
-                self.sock.sendto(message.encode("utf-8"), (self.udp_ip, self.udp_port))
-        except Exception as e:
-            print(f"[YAMNet] UDP send error: {e}")
+        """Send detection results (str or already-encoded bytes) via UDP."""
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        # Empty messages are skipped and send errors logged by the handler
+        _udp_sender.send_bytes(message, self.udp_port, self.udp_ip)
     
     def process_audio(self, audio_data):
         """
-        Add audio data to the processing queue.
+        Copy audio data into the processing ring.
         
         Args:
             audio_data: numpy array of audio samples (float32, -1.0 to 1.0)
@@ -99,11 +115,9 @@ class YAMNetDetector:
         if not self.running:
             return
         
-        try:
-            # Non-blocking put - drop audio if queue is full
-            self.audio_queue.put_nowait(audio_data.copy())
-        except queue.Full:
-            pass  # Skip if queue is full (real-time priority)
+        # Copy into a preallocated slot - oldest audio is dropped if full
+        # (ravel() is a view for the mono blocks the callback delivers)
+        self.audio_ring.put(audio_data.ravel())
     
     def _detection_loop(self):
         """Main detection loop running in a separate thread."""
@@ -111,46 +125,38 @@ class YAMNetDetector:
         
         while self.running:
             try:
-                # Get audio from queue with timeout
-                audio_data = self.audio_queue.get(timeout=0.1)
-                
-                # Ensure audio is 1D and in the correct format
-                if len(audio_data.shape) > 1:
-                    audio_data = audio_data.flatten()
+                # Get audio from ring with timeout (valid until the next get)
+                # Ring slots are 1D float32 in range [-1.0, 1.0], as YAMNet expects
+                waveform = self.audio_ring.get(timeout=0.1)
+                if self.audio_ring.pending():
+                    waveform = drain_backlog(self.audio_ring, waveform, self.batch_buffer)
                 
-                # YAMNet expects float32 in range [-1.0, 1.0]
-                # Audio comes as float32 from STT callback already normalized
-                waveform = np.asarray(audio_data, dtype=np.float32)
-                
-                if waveform.size == 0:
+                if waveform.size == 0 or block_rms(waveform) < self.silence_threshold:
                     continue
                 
                 # Run inference
                 scores, embeddings, spectrogram = self.model(waveform)
-                scores = scores.numpy()  # shape: (frames, 521)
+                scores = np.asarray(scores)  # shape: (frames, 521)
                 
                 if scores.ndim != 2 or scores.shape[0] == 0:
                     continue
                 
-                # Get mean scores across all frames
-                mean_scores = scores.mean(axis=0)
-                
-                # Get top prediction
-                top_index = int(np.argmax(mean_scores))
-                confidence = float(mean_scores[top_index])
+                # Get top prediction by mean score across all frames
+                top_index, confidence = top_class(scores)
                 
                 # Send detection if above threshold
                 if confidence >= self.confidence_threshold:
-                    class_name = self.class_names[top_index] if top_index < len(self.class_names) else f"class_{top_index}"
-                    
-                    detection = {
-                        "event": class_name,
-                        "class_id": int(top_index),
-                        "confidence": round(confidence, 3),
-                        "timestamp": time.time()
-                    }
+                    if top_index < len(self.event_prefixes):
+                        class_name = self.class_names[top_index]
+                        prefix = self.event_prefixes[top_index]
+                    else:
+                        class_name = f"class_{top_index}"
+                        prefix = self._event_prefix(class_name, top_index)
                     
-                    self.send_udp(json.dumps(detection))
+                    # Same JSON as json.dumps of the detection dict; only the
+                    # confidence and timestamp are formatted per detection
+                    self.send_udp(prefix + ('"confidence": %r, "timestamp": %r}' % (
+                        round(confidence, 3), time.time())).encode("utf-8"))
                     print(f"[YAMNet] Detected: {class_name} (confidence {confidence:.2f})")
                 
             except queue.Empty:
@@ -181,5 +187,4 @@ class YAMNetDetector:
             self.thread.join(timeout=2.0)
             if self.thread.is_alive():
                 print("[YAMNet] Warning: Thread did not stop within timeout")
-        self.sock.close()
         print("[YAMNet] Service stopped")
@@ -4,7 +4,11 @@ YAMNet Service Module
 Handles YAMNet sound event detection in its own thread.
 """
 
+import ast
 import csv
+import io
+import logging
+import os
 import numpy as np
 import tensorflow as tf
 import tensorflow_hub as hub
@@ -13,7 +17,263 @@ import json
 import threading
 import queue
 import time
-from typing import Optional
+import weakref
+from typing import Optional, Tuple
+
+from audio_ring import AudioRing
+from model_threads import default_num_threads
+from pcm_kernels import PCM16_INV_SCALE, PCMConverter, block_rms
+
+
+logger = logging.getLogger("stt.yamnet")
+
+YAMNET_MODEL_URL = "https://tfhub.dev/google/yamnet/1"
+YAMNET_SAMPLE_RATE = 16000
+
+# TF Hub downloads are kept here instead of the system temp dir, so the
+# SavedModel survives reboots and later starts load it from disk
+TFHUB_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "tfhub")
+
+# AudioSet class names in model output order, fetched only for TFLite models
+# (the SavedModel ships the same CSV as an asset)
+CLASS_MAP_URL = (
+    "https://raw.githubusercontent.com/tensorflow/models/master/"
+    "research/audioset/yamnet/yamnet_class_map.csv"
+)
+
+# Class names from the first successful load_class_names() call
+_class_names: Optional[Tuple[str, ...]] = None
+
+# Loaded models by path or URL, kept only while a service or detector uses them
+_MODEL_CACHE = weakref.WeakValueDictionary()
+
+
+def check_sample_rate(sample_rate: int):
+    """
+    Reject capture rates YAMNet cannot use; audio is never resampled here.
+    
+    Args:
+        sample_rate: Capture sample rate in Hz
+        
+    Raises:
+        ValueError: If sample_rate is not YAMNET_SAMPLE_RATE
+    """
+    if sample_rate != YAMNET_SAMPLE_RATE:
+        raise ValueError(f"YAMNet requires {YAMNET_SAMPLE_RATE} Hz audio, got {sample_rate} Hz")
+
+
+def top_class(scores: np.ndarray) -> Tuple[int, float]:
+    """
+    Class with the highest mean score across frames.
+    
+    Args:
+        scores: (frames, 521) array of per-frame class scores
+        
+    Returns:
+        (class index, mean score of that class)
+    """
+    mean_scores = scores.mean(axis=0)
+    index = int(np.argmax(mean_scores))
+    return index, float(mean_scores[index])
+
+
+def drain_backlog(ring: AudioRing, first_block: np.ndarray, batch_buffer: np.ndarray,
+                  scale: Optional[np.float32] = None) -> np.ndarray:
+    """
+    Merge a block and the blocks queued behind it into one batch, so they
+    run through the model in a single inference.
+    
+    Args:
+        ring: Ring the blocks are taken from
+        first_block: Block just taken from the ring
+        batch_buffer: Preallocated float32 buffer of up to max_batch blocks
+        scale: Factor applied while copying (PCM16_INV_SCALE converts int16
+               blocks to float32); None copies the samples unchanged
+        
+    Returns:
+        View of batch_buffer holding the merged samples
+    """
+    get_audio = ring.get
+    block_size = ring.block_size
+    block = first_block
+    filled = 0
+    while True:
+        end = filled + block.shape[0]
+        if scale is None:
+            batch_buffer[filled:end] = block
+        else:
+            np.multiply(block, scale, out=batch_buffer[filled:end])
+        filled = end
+        if filled + block_size > batch_buffer.shape[0]:
+            break
+        try:
+            block = get_audio(timeout=0)
+        except queue.Empty:
+            break
+    return batch_buffer[:filled]
+
+
+class TFLiteYAMNet:
+    """
+    YAMNet converted to TFLite (see convert_yamnet_tflite.py), callable like
+    the hub layer. Runs on the XNNPACK CPU kernels, which with int8 weights
+    are several times faster than the float32 SavedModel.
+    
+    An interpreter is not thread-safe: each detection thread needs its own.
+    """
+    
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Initialize the interpreter.
+        
+        Args:
+            model_path: Path to a .tflite model with float32 waveform input
+            num_threads: CPU threads for the interpreter (None = TFLite default)
+        """
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input_index = self.interpreter.get_input_details()[0]["index"]
+        # Output order is not fixed by the converter; scores have 521 classes
+        self._scores_index = next(
+            detail["index"] for detail in self.interpreter.get_output_details()
+            if detail["shape"][-1] == 521
+        )
+        self._input_size = None
+        
+    def __call__(self, waveform: np.ndarray):
+        """
+        Run inference on a 1D float32 waveform.
+        
+        Returns:
+            (scores, None, None); embeddings and spectrogram are not read back
+        """
+        interpreter = self.interpreter
+        # Tensors are only reallocated when the waveform length changes
+        if waveform.shape[0] != self._input_size:
+            interpreter.resize_tensor_input(self._input_index, [waveform.shape[0]], strict=False)
+            interpreter.allocate_tensors()
+            self._input_size = waveform.shape[0]
+        interpreter.set_tensor(self._input_index, waveform)
+        interpreter.invoke()
+        return interpreter.get_tensor(self._scores_index), None, None
+
+
+def load_yamnet_model(model_path: str = YAMNET_MODEL_URL, num_threads: Optional[int] = None):
+    """
+    Load YAMNet as a Keras layer, or as a TFLite interpreter for .tflite files.
+    
+    Keras layers are shared: while one is alive, every YAMNetService and
+    YAMNetDetector asking for the same path gets that instance.
+    
+    Args:
+        model_path: Local SavedModel directory, a TF Hub URL that is
+                    downloaded once into TFHUB_CACHE_DIR, or a .tflite file
+        num_threads: CPU threads for a TFLite interpreter (None = TFLite default)
+                    
+    Returns:
+        Callable returning (scores, embeddings, spectrogram) for a waveform
+    """
+    if model_path.endswith(".tflite"):
+        # Interpreters are not thread-safe, so each caller gets its own
+        return TFLiteYAMNet(model_path, num_threads)
+    model = _MODEL_CACHE.get(model_path)
+    if model is None:
+        # An explicit TFHUB_CACHE_DIR in the environment takes precedence
+        os.environ.setdefault("TFHUB_CACHE_DIR", TFHUB_CACHE_DIR)
+        model = hub.KerasLayer(model_path, trainable=False)
+        _MODEL_CACHE[model_path] = model
+    return model
+
+
+def _read_class_map(model) -> str:
+    """
+    Read the AudioSet class map CSV for a loaded model.
+    
+    The TF Hub SavedModel carries the CSV as an asset, already on disk in
+    TFHUB_CACHE_DIR; only TFLite models, which have no assets, download it.
+    
+    Args:
+        model: Model returned by load_yamnet_model()
+        
+    Returns:
+        CSV text
+    """
+    resolved = getattr(model, "resolved_object", None)
+    if resolved is not None and hasattr(resolved, "class_map_path"):
+        path = resolved.class_map_path().numpy().decode("utf-8")
+        with open(path, newline="") as file:
+            return file.read()
+    logger.info("[YAMNet] Downloading class map CSV...")
+    response = requests.get(CLASS_MAP_URL, timeout=5)
+    response.raise_for_status()
+    return response.text
+
+
+def trace_yamnet_model(model, warmup_samples: int, jit_compile: bool = False,
+                       max_batch: int = 1):
+    """
+    Trace the model once as a tf.function for any 1D float32 waveform.
+    
+    The fixed input signature means waveforms of different lengths (single
+    blocks, merged backlogs) reuse one traced graph instead of retracing.
+    XLA, however, compiles a separate executable for each distinct input
+    length, so with jit_compile every batch length from one block up to
+    max_batch blocks is compiled here rather than on the first detection
+    that sees it. Lengths that are not a multiple of warmup_samples still
+    compile on first use.
+    
+    Args:
+        model: Loaded YAMNet model
+        warmup_samples: Samples per block; the silent warmup waveform length
+        jit_compile: Also compile the graph with XLA
+        max_batch: Most blocks merged into one inference (XLA warmup only)
+        
+    Returns:
+        Traced callable, or the model itself for TFLite models (already
+        compiled) or if tracing fails
+    """
+    if isinstance(model, TFLiteYAMNet):
+        return model
+    traced = tf.function(
+        model,
+        jit_compile=jit_compile,
+        input_signature=[tf.TensorSpec([None], tf.float32)],
+    )
+    batch_sizes = range(1, max(1, max_batch) + 1) if jit_compile else (1,)
+    try:
+        for n in batch_sizes:
+            traced(tf.zeros([n * warmup_samples], tf.float32))
+    except Exception as e:
+        logger.warning("[YAMNet] ⚠️ Graph tracing failed, running eagerly: %s", e)
+        return model
+    return traced
+
+
+def load_class_names(model) -> Tuple[str, ...]:
+    """
+    Load YAMNet class names from the AudioSet class map CSV.
+    
+    Falls back to generic class names if the CSV cannot be read. A
+    successful load is kept for the process and shared by every detector;
+    after a failure the next call tries again.
+    
+    Args:
+        model: Model returned by load_yamnet_model() (before tracing)
+    """
+    global _class_names
+    if _class_names is not None:
+        return _class_names
+    try:
+        text = _read_class_map(model)
+        # csv handles the quoted names that contain commas
+        # (e.g. "Chuckle, chortle"), which a plain split would cut short
+        reader = csv.reader(io.StringIO(text))
+        next(reader)  # Skip header
+        _class_names = tuple(row[2] for row in reader if len(row) >= 3)
+        logger.info("[YAMNet] ✅ Loaded %s class names", len(_class_names))
+        return _class_names
+    except Exception as e:
+        logger.warning("[YAMNet] ⚠️ Failed to load class map, using generic labels: %s", e)
+        return tuple(f"class_{i}" for i in range(521))
 
 
 class YAMNetService:
@@ -22,7 +282,7 @@ class YAMNetService:
     Processes audio in a separate thread and sends detected events via UDP.
     """
     
-    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000):
+    def __init__(self, config_path: str, udp_handler, sample_rate: int = 16000, block_size: int = 4096):
         """
         Initialize the YAMNet service.
         
@@ -30,7 +290,12 @@ class YAMNetService:
             config_path: Path to YAMNet configuration CSV file
             udp_handler: UDPHandler instance for sending messages
             sample_rate: Audio sample rate (YAMNet expects 16kHz)
+            block_size: Expected samples per audio block (sizes the ring slots)
+            
+        Raises:
+            ValueError: If sample_rate is not 16 kHz
         """
+        check_sample_rate(sample_rate)
         self.sample_rate = sample_rate
         self.udp_handler = udp_handler
         self.running = False
@@ -38,13 +303,26 @@ class YAMNetService:
         # Load configuration
         self.config = self._load_config(config_path)
         
-        # Initialize queue with size from config
+        # Initialize ring with size from config
         queue_size = self.config.get("QUEUE_SIZE", 100)
-        self.audio_queue = queue.Queue(maxsize=queue_size)
+        self.audio_ring = AudioRing(queue_size, block_size, dtype=np.int16)
+        
+        self._pcm_in = PCMConverter(block_size)
+        
+        # The worker converts the block it takes, plus any blocks queued
+        # behind it, into this float32 buffer and runs the model once
+        max_batch = self.config.get("MAX_BATCH", 4)
+        self.batch_buffer = np.empty(max(1, max_batch) * block_size, dtype=np.float32)
+        
+        # Detection settings, read and converted once
+        self.udp_port = int(self.config.get("UDP_PORT", 7204))
+        self.confidence_threshold = float(self.config.get("CONFIDENCE_THRESHOLD", 0.3))
+        self.silence_threshold = float(self.config.get("SILENCE_THRESHOLD", 0.001))
         
-        # Model (lazy loaded)
+        # Model (lazy loaded) and the TensorFlow device it runs on
         self.model = None
-        self.class_names = []
+        self.class_names = ()
+        self.device = "/CPU:0"
         
         # Thread
         self.thread: Optional[threading.Thread] = None
@@ -59,65 +337,68 @@ class YAMNetService:
                 for row in reader:
                     if len(row) >= 2:
                         key, value = row[0], row[1]
-                        # Convert numeric values
+                        # Numbers (and None/True/False) are parsed as Python
+                        # literals; anything else is kept as a string
                         try:
-                            if '.' in value:
-                                config[key] = float(value)
-                            elif value.isdigit():
-                                config[key] = int(value)
-                            else:
-                                config[key] = value
-                        except ValueError:
+                            config[key] = ast.literal_eval(value)
+                        except (ValueError, SyntaxError):
                             config[key] = value
-            print(f"[YAMNet Service] Configuration loaded from {config_path}")
+            logger.info("[YAMNet Service] Configuration loaded from %s", config_path)
         except Exception as e:
-            print(f"[YAMNet Service] Error loading config: {e}")
+            logger.error("[YAMNet Service] Error loading config: %s", e)
         return config
     
-    def _load_class_names(self):
+    def _select_device(self) -> str:
         """
-        Load YAMNet class names from the AudioSet CSV.
+        Pick the TensorFlow device for inference from the DEVICE config.
         
-        Downloads the official class map CSV from the TensorFlow models repository.
-        Falls back to generic class names if download fails.
+        Returns:
+            "/GPU:0" if DEVICE is "auto" (default) or "gpu" and a GPU is
+            visible, "/CPU:0" otherwise
         """
-        CLASS_MAP_URL = (
-            "https://raw.githubusercontent.com/tensorflow/models/master/"
-            "research/audioset/yamnet/yamnet_class_map.csv"
-        )
-        try:
-            print("[YAMNet Service] Downloading class map CSV...")
-            response = requests.get(CLASS_MAP_URL, timeout=5)
-            response.raise_for_status()
-            class_names = [
-                line.split(",")[2].strip('"')
-                for line in response.text.splitlines()[1:]
-            ]
-            print(f"[YAMNet Service] ✅ Loaded {len(class_names)} class names")
-            return class_names
-        except Exception as e:
-            print(f"[YAMNet Service] ⚠️ Failed to load class map, using generic labels: {e}")
-            return [f"class_{i}" for i in range(521)]
+        gpus = tf.config.list_physical_devices("GPU")
+        for gpu in gpus:
+            try:
+                # Allocate VRAM as needed instead of reserving all of it, so
+                # Whisper (PyTorch) can share the GPU
+                tf.config.experimental.set_memory_growth(gpu, True)
+            except RuntimeError:
+                pass  # GPU already initialized; keep its allocator settings
+        if gpus and str(self.config.get("DEVICE", "auto")).lower() != "cpu":
+            return "/GPU:0"
+        return "/CPU:0"
     
     def _initialize_model(self):
         """Initialize the YAMNet model."""
         try:
-            print("[YAMNet Service] Loading model from TensorFlow Hub...")
-            self.model = hub.KerasLayer(
-                "https://tfhub.dev/google/yamnet/1",
-                trainable=False,
-            )
-            # Load class names
-            self.class_names = self._load_class_names()
-            print("[YAMNet Service] ✅ Model loaded successfully")
+            model_path = self.config.get("MODEL_PATH", YAMNET_MODEL_URL)
+            self.device = self._select_device()
+            num_threads = default_num_threads(self.config.get("NUM_THREADS", 0))
+            if model_path in _MODEL_CACHE:
+                logger.info("[YAMNet Service] Reusing loaded model")
+            else:
+                try:
+                    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                    # YAMNet's graph is one sequential chain of layers, so a
+                    # small inter-op pool is enough and leaves no idle threads
+                    tf.config.threading.set_inter_op_parallelism_threads(2)
+                except RuntimeError:
+                    pass  # TensorFlow is already initialized; keep its thread pool
+                logger.info("[YAMNet Service] Loading model from %s (%s)...", model_path, self.device)
+            self.model = load_yamnet_model(model_path, num_threads)
+            # Class names are loaded once per process and shared
+            self.class_names = load_class_names(self.model)
+            with tf.device(self.device):
+                self.model = trace_yamnet_model(self.model, self.audio_ring.block_size)
+            logger.info("[YAMNet Service] ✅ Model loaded successfully")
             return True
         except Exception as e:
-            print(f"[YAMNet Service] ❌ Error loading model: {e}")
+            logger.error("[YAMNet Service] ❌ Error loading model: %s", e)
             return False
     
     def process_audio(self, audio_data: np.ndarray):
         """
-        Add audio data to the processing queue.
+        Copy audio data into the processing ring.
         
         Args:
             audio_data: numpy array of audio samples (float32, -1.0 to 1.0)
@@ -125,53 +406,66 @@ class YAMNetService:
         if not self.running:
             return
         
-        try:
-            # Non-blocking put - drop audio if queue is full
-            self.audio_queue.put_nowait(audio_data.copy())
-        except queue.Full:
-            pass  # Skip if queue is full (real-time priority)
+        # Convert to PCM and copy into a preallocated slot - oldest audio
+        # is dropped if full
+        self.audio_ring.put(self._pcm_in.to_pcm16(audio_data.reshape(-1)))
+    
+    def process_audio_pcm16(self, pcm_data: np.ndarray):
+        """
+        Copy int16 PCM audio into the processing ring.
+        
+        Args:
+            pcm_data: numpy array of int16 PCM samples
+        """
+        if not self.running:
+            return
+        
+        self.audio_ring.put(pcm_data)
     
     def _detection_loop(self):
         """Main detection loop running in a separate thread."""
-        print("[YAMNet Service] Detection thread started")
+        logger.info("[YAMNet Service] Detection thread started")
         
-        # Get configuration
-        udp_port = self.config.get("UDP_PORT", 7204)
-        confidence_threshold = self.config.get("CONFIDENCE_THRESHOLD", 0.3)
+        # Bind settings and per-block methods once so the loop uses local lookups
+        udp_port = self.udp_port
+        confidence_threshold = self.confidence_threshold
+        silence_threshold = self.silence_threshold
+        device = self.device
+        audio_ring = self.audio_ring
+        get_audio = audio_ring.get
+        batch_buffer = self.batch_buffer
+        send_json = self.udp_handler.send_json
         
         while self.running:
             try:
-                # Get audio from queue with timeout
-                audio_data = self.audio_queue.get(timeout=0.1)
+                # Get audio from ring with timeout
+                audio_data = get_audio(timeout=0.1)
                 
-                # Ensure audio is 1D and in the correct format
-                if len(audio_data.shape) > 1:
-                    audio_data = audio_data.flatten()
+                # YAMNet expects float32 in range [-1.0, 1.0]; ring slots hold
+                # int16 PCM, so convert here, off the audio thread. Blocks that
+                # queued up meanwhile join this inference instead of waiting
+                waveform = drain_backlog(audio_ring, audio_data, batch_buffer, PCM16_INV_SCALE)
                 
-                # YAMNet expects float32 in range [-1.0, 1.0]
-                waveform = np.asarray(audio_data, dtype=np.float32)
-                
-                if waveform.size == 0:
+                # Skip the model on silence; one dot product is far cheaper
+                # than an inference
+                if waveform.size == 0 or block_rms(waveform) < silence_threshold:
                     continue
                 
                 # Check if model is loaded
                 if self.model is None:
-                    print("[YAMNet Service] Model not loaded, cannot run inference.")
+                    logger.warning("[YAMNet Service] Model not loaded, cannot run inference.")
                     continue
 
-                # Run inference
-                scores, embeddings, spectrogram = self.model(waveform)
-                scores = scores.numpy()  # shape: (frames, 521)
+                # Run inference (TFLite models always run on the CPU)
+                with tf.device(device):
+                    scores, embeddings, spectrogram = self.model(waveform)
+                scores = np.asarray(scores)  # shape: (frames, 521)
                 
                 if scores.ndim != 2 or scores.shape[0] == 0:
                     continue
                 
-                # Get mean scores across all frames
-                mean_scores = scores.mean(axis=0)
-                
-                # Get top prediction
-                top_index = int(np.argmax(mean_scores))
-                confidence = float(mean_scores[top_index])
+                # Get top prediction by mean score across all frames
+                top_index, confidence = top_class(scores)
                 
                 # Send detection if above threshold
                 if confidence >= confidence_threshold:
@@ -184,21 +478,21 @@ class YAMNetService:
                         "timestamp": time.time()
                     }
                     
-                    self.udp_handler.send_json(detection, udp_port)
-                    #print(f"[YAMNet Service] Detected: {class_name} (confidence {confidence:.2f})")
+                    send_json(detection, udp_port)
+                    logger.debug("[YAMNet Service] Detected: %s (confidence %.2f)", class_name, confidence)
                 
             except queue.Empty:
                 continue
             except Exception as e:
-                print(f"[YAMNet Service] Detection error: {e}")
+                logger.error("[YAMNet Service] Detection error: %s", e)
                 time.sleep(0.1)
         
-        print("[YAMNet Service] Detection thread stopped")
+        logger.info("[YAMNet Service] Detection thread stopped")
     
     def start(self) -> bool:
         """Start the YAMNet service in a separate thread."""
         if self.running:
-            print("[YAMNet Service] Already running")
+            logger.info("[YAMNet Service] Already running")
             return False
         
         # Initialize model
@@ -208,15 +502,15 @@ class YAMNetService:
         self.running = True
         self.thread = threading.Thread(target=self._detection_loop, daemon=False)
         self.thread.start()
-        print("[YAMNet Service] Service started")
+        logger.info("[YAMNet Service] Service started")
         return True
     
     def stop(self):
         """Stop the YAMNet service."""
-        print("[YAMNet Service] Stopping...")
+        logger.info("[YAMNet Service] Stopping...")
         self.running = False
         if self.thread:
             self.thread.join(timeout=2.0)
             if self.thread.is_alive():
-                print("[YAMNet Service] Warning: Thread did not stop within timeout")
-        print("[YAMNet Service] Service stopped")
+                logger.warning("[YAMNet Service] Warning: Thread did not stop within timeout")
+        logger.info("[YAMNet Service] Service stopped")